@@ -8,17 +8,20 @@ GZChunker - also in this file.
 
 Attributes:
     CACHE_DIR (str): Location of the godzillops cache directory. Stored in the system's
-        temporary directory. Used for caching the trained NLTK ClassifierBasedPOSTagger.
+        temporary directory. Used for caching Google OAuth access tokens between runs.
 """
 import json
 import logging
 import os
 import pickle
+import pkgutil
 import random
 import re
+import tempfile
 import urllib.request as urlreq
 from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache
 
 import nltk
 from nltk.tokenize import TweetTokenizer
@@ -29,6 +32,18 @@ from .github import GitHubAdmin
 from .google import GOOGLE_GROUP_TAGS, GoogleAdmin
 from .trello import TrelloAdmin
 
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "godzillops")
+
+
+@lru_cache(maxsize=None)
+def _load_tagger():
+    """Load the pickled POS tagger once per process - tagging never changes it, so Chats can share it.
+
+    Returns:
+        ClassifierBasedPOSTagger: The NLTK POS tagger trained on the brown corpus.
+    """
+    return pickle.loads(pkgutil.get_data("godzillops", "tagger.pickle"))
+
 
 def _generate_in_dict(action_state):
     """Use previous action state to default in_dict
@@ -278,6 +293,9 @@ class Chat(object):
     Instantiated in the Tokyo runtime for handling responses to chat input.
     """
 
+    # Plain words separated by whitespace - tokenizes the same with str.split as with NLTK
+    simple_input_regexp = re.compile(r"\s*[^\W\d_]+(?:\s+[^\W\d_]+)*\s*")
+
     def __init__(self, config):
         """Initialize the Godzillops chat bot brains.
 
@@ -306,6 +324,7 @@ class Chat(object):
             self.config.GOOGLE_CALENDAR_ID,
             self.config.GOOGLE_WELCOME_TEXT,
             self.config.GOOGLE_WELCOME_ATTACHMENTS,
+            token_cache_dir=CACHE_DIR,
         )
         self.trello_admin = TrelloAdmin(
             self.config.TRELLO_ORG, self.config.TRELLO_API_KEY, self.config.TRELLO_TOKEN
@@ -313,6 +332,18 @@ class Chat(object):
         self.github_admin = GitHubAdmin(self.config.GITHUB_ORG, self.config.GITHUB_ACCESS_TOKEN)
         self.abacus_admin = AbacusAdmin(self.config.ABACUS_ZAPIER_WEBHOOK)
 
+        # Actions map the action labels determined from chunked text
+        # to the methods that execute them.
+        self.actions = {
+            "cancel": self.cancel,
+            "create_google_account": self.create_google_account,
+            "invite_to_trello": self.invite_to_trello,
+            "invite_to_github": self.invite_to_github,
+            "invite_to_abacus": self.invite_to_abacus,
+            "greet": self.greet,
+            "gz_gif": self.gz_gif,
+        }
+
         # Action state is a dictionary used for managing incomplete
         # actions - cases where Godzillops needs to clarify or ask for more
         # information before finishing an action.
@@ -335,12 +366,10 @@ class Chat(object):
 
             self.tagger = ClassifierBasedPOSTagger(train=brown.tagged_sents())
             with open('tagger.pickle', 'wb') as tagger_pickle:
-                pickle.dump(self.tagger, tagger_pickle)
+                pickle.dump(self.tagger, tagger_pickle, protocol=4)
         """
-        tagger_path = os.path.join(os.path.dirname(__file__), "tagger.pickle")
-        with open(tagger_path, "rb") as tagger_pickle:
-            self.tagger = pickle.load(tagger_pickle)
-            logging.debug("tagger.pickle loaded from cache")
+        self.tagger = _load_tagger()
+        logging.debug("tagger.pickle loaded from cache")
 
     #
     # ACTION STATE HELPERS - used to manager per user action states - or continued
@@ -432,6 +461,25 @@ class Chat(object):
     # DETERMINE ACTION AND RESPOND
     #
 
+    def _tokenize(self, _input, action_state):
+        """Split user input into tokens for the POS tagger.
+
+        Args:
+            _input (str): String of text sent from a tokyo platform user.
+            action_state (dict): Current action for a given user (if mid unfinished action).
+
+        Returns:
+            list: List of string tokens.
+        """
+        if self.simple_input_regexp.fullmatch(_input):
+            # Nothing but words & whitespace - skip the regex heavy tokenizers
+            return _input.split()
+        elif action_state.get("regexp_tokenize"):
+            # Use simple alphanumeric Regex - used in some actions
+            return nltk.regexp_tokenize(_input, r"[\w]+")
+        # Use Twitter Tokenizer - split by space, punctuation but not on @ & #
+        return self.tokenizer.tokenize(_input)
+
     def determine_action(self, chunked_text, action_state):
         """Determine Chat Bot's Actions
 
@@ -444,8 +492,8 @@ class Chat(object):
 
         Returns:
             tuple: A tuple with two items:
-                action (str): This string corresponds to the keys in the self.actions mapping.
-                    Whatever the value is determines what function will be ran in self.respond.
+                handler (function): The action method from the self.actions mapping that will be
+                    ran in self.respond - self.nop if no action was determined.
                 kwargs (dict): Dynamic keyword arguments passed to each action function.
         """
         logging.debug(chunked_text)
@@ -455,11 +503,11 @@ class Chat(object):
         if action == "create_google_account" and action_state["step"] == "username":
             # Short circuit subtree parsing, and treat first leaf as a username
             kwargs["username"], _ = chunked_text.leaves()[0]
-            return action, kwargs
+            return self.actions[action], kwargs
         elif action == "invite_to_github" and action_state["step"] == "username":
             # Short circuit subtree parsing, and treat all leaves as username
             kwargs["username"], _ = chunked_text.leaves()[0]
-            return action, kwargs
+            return self.actions[action], kwargs
 
         # Used to store named entities
         entity_dict = defaultdict(list)
@@ -512,7 +560,7 @@ class Chat(object):
         # Update current action state with determined course of action
         self._set_action_state(action=action, kwargs=kwargs)
 
-        return action, kwargs
+        return self.actions.get(action, self.nop), kwargs
 
     def respond(self, _input, context=None):
         """Respond to user input
@@ -536,24 +584,15 @@ class Chat(object):
             action_state = self._get_action_state()
 
             # Tokenize raw _input
-            if action_state.get("regexp_tokenize"):
-                # Use simple alphanumeric Regex - used in some actions
-                tokens = nltk.regexp_tokenize(_input, r"[\w]+")
-            else:
-                # Use Twitter Tokenizer - split by space, punctuation but not on @ & #
-                tokens = self.tokenizer.tokenize(_input)
-
+            tokens = self._tokenize(_input, action_state)
             # Tag for POS using Brown corpus ClassifierBasedPOSTagger
             tagged_text = self.tagger.tag(tokens)
             # Parse the text using GZChunker into actionable chunks
             chunked_text = self.chunker.parse(tagged_text, action_state)
             # Determine what the action should be, and prepare keyword args for the returned function
-            action, kwargs = self.determine_action(chunked_text, action_state)
-
-            if action is not None:
-                # If we should take action, execute the function with the kwargs
-                # now and return the results
-                responses = getattr(self, action)(**kwargs)
+            handler, kwargs = self.determine_action(chunked_text, action_state)
+            # Execute the action's function with the kwargs now and return the results
+            responses = handler(**kwargs)
         except BaseException:
             logging.exception("An error occurred responding to the user.")
             responses = ("I... erm... what? Try again.",)
@@ -722,6 +761,10 @@ class Chat(object):
         yield "Can I help you with anything?"
         yield self._clear_action_state(action_success=True)
 
+    def nop(self, **_):
+        """No action was determined from the user's input, so say nothing."""
+        return ()
+
     def gz_gif(self, **_):
         """Return a random Godzilla GIF."""
         yield "RAWR!"
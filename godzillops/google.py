@@ -6,6 +6,10 @@ with Google Admin SDK for creating users and managing groups.
 
 Attributes:
     GOOGLE_GROUP_TAGS (tuple[str]): List of supported google group POS tags
+    HTTP_TIMEOUT (int): Socket timeout in seconds for the connection shared by all Google API services.
+    MAX_BATCH_REQUESTS (int): The most requests Google APIs accept in a single batch request.
+    MAX_GMAIL_BATCH_REQUESTS (int): The most requests to put in a single Gmail API batch request -
+        larger Gmail batches are likely to be rate limited.
     PASSWORD_CHARACTERS (str): All possible password characters used in generating
         random user passwords.
     PASSWORD_LENGTH (int): The default generated password length.
@@ -13,28 +17,44 @@ Attributes:
         modifying these scopes, delete your previously saved credentials located in
         your system's temporary directory - they'll be named something
         like 'google-api-python-client-discovery-doc.cache'
+    USERNAME_CACHE_TTL (int): Seconds to trust a cached "username is available" answer. Usernames
+        found to be taken are cached for the life of the GoogleAdmin instance.
 """
 import base64
+import hashlib
+import json
 import logging
 import mimetypes
 import os
-import random
+import secrets
+import stat
 import string
+import tempfile
+import time
+from datetime import datetime, timezone
 from email.encoders import encode_base64
-from email.mime.audio import MIMEAudio
 from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.policy import compat32
+from functools import lru_cache
 
 from apiclient.errors import HttpError
 from apiclient.discovery import build
 from httplib2 import Http
+from oauth2client.client import EXPIRY_FORMAT
 from oauth2client.service_account import ServiceAccountCredentials
 
 GOOGLE_GROUP_TAGS = ("GDEV", "GDES", "GCRE", "GFOU")
+HTTP_TIMEOUT = 30
+MAX_BATCH_REQUESTS = 1000
+MAX_GMAIL_BATCH_REQUESTS = 100
 PASSWORD_CHARACTERS = string.ascii_letters + string.punctuation + string.digits
 PASSWORD_LENGTH = 18
+# Translation table from random bytes to password characters. Bytes at or above the largest
+# multiple of len(PASSWORD_CHARACTERS) are thrown out so each character is equally likely.
+_PASSWORD_TABLE = bytes(ord(PASSWORD_CHARACTERS[i % len(PASSWORD_CHARACTERS)]) for i in range(256))
+_PASSWORD_REJECTS = bytes(range(256 - 256 % len(PASSWORD_CHARACTERS), 256))
 SCOPES = [
     "https://www.googleapis.com/auth/admin.directory.domain.readonly",
     "https://www.googleapis.com/auth/admin.directory.user",
@@ -42,6 +62,113 @@ SCOPES = [
     "https://www.googleapis.com/auth/gmail.send",
     "https://www.googleapis.com/auth/calendar",
 ]
+USERNAME_CACHE_TTL = 60
+# Gmail takes the raw RFC 2822 message, so skip folding long ASCII headers while rendering it.
+# Non-ASCII headers still need folding - it's how compat32 splits RFC 2047 encoded-words.
+_MESSAGE_POLICY = compat32.clone(max_line_length=None)
+
+# Authorized API services & primary domain keyed by (client_email, sub_account) - shared
+# by GoogleAdmin instances so discovery, OAuth & the domain lookup only happen once
+_SERVICE_CACHE = {}
+
+
+@lru_cache(maxsize=128)
+def _guess_content_type(path):
+    """Guess an attachment's MIME type from its file name - cached since they're sent to every new user.
+
+    Args:
+        path (str): Path of the file being attached.
+
+    Returns:
+        str: The guessed content type, application/octet-stream if unknown or compressed.
+    """
+    content_type, encoding = mimetypes.guess_type(path)
+    if content_type is None or encoding is not None:
+        content_type = "application/octet-stream"
+    return content_type
+
+
+def _private_token_dir(token_dir):
+    """Make sure the access token directory exists & only the current user can change it.
+
+    Tokens are saved in a shared temporary directory by default, so refuse to use a directory
+    someone else created (or a symlink to one) - they could swap in tokens of their own.
+
+    Args:
+        token_dir (str): Location of the access token cache directory.
+
+    Returns:
+        bool: True if access tokens can safely be saved to & loaded from the directory.
+    """
+    try:
+        os.makedirs(token_dir, mode=0o700, exist_ok=True)
+        dir_stat = os.lstat(token_dir)
+        if not stat.S_ISDIR(dir_stat.st_mode):
+            raise NotADirectoryError(token_dir)
+        if hasattr(os, "getuid"):
+            if dir_stat.st_uid != os.getuid():
+                logging.warning(
+                    "Not caching Google access tokens in %s, another user owns it", token_dir
+                )
+                return False
+            if dir_stat.st_mode & 0o077:
+                os.chmod(token_dir, 0o700)
+    except OSError:
+        logging.warning("Unable to use %s to cache Google access tokens", token_dir)
+        return False
+    return True
+
+
+def _load_access_token(credentials, token_path):
+    """Give credentials a still valid OAuth access token saved by a previous GoogleAdmin.
+
+    Args:
+        credentials (OAuth2Credentials): Delegated service account credentials.
+        token_path (str): Location of the saved access token JSON file.
+    """
+    if not _private_token_dir(os.path.dirname(token_path)):
+        return
+
+    try:
+        with open(token_path) as token_file:
+            token = json.load(token_file)
+        access_token = token["access_token"]
+        token_expiry = datetime.strptime(token["token_expiry"], EXPIRY_FORMAT)
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+
+    # oauth2client token expiries are naive UTC datetimes
+    if token_expiry > datetime.now(timezone.utc).replace(tzinfo=None):
+        credentials.access_token = access_token
+        credentials.token_expiry = token_expiry
+
+
+def _save_access_token(credentials, token_path):
+    """Save the credentials' OAuth access token so later GoogleAdmins skip the token exchange.
+
+    Args:
+        credentials (OAuth2Credentials): Delegated service account credentials.
+        token_path (str): Location to save the access token JSON file.
+    """
+    if not credentials.access_token or not credentials.token_expiry:
+        return
+
+    token = {
+        "access_token": credentials.access_token,
+        "token_expiry": credentials.token_expiry.strftime(EXPIRY_FORMAT),
+    }
+    token_dir = os.path.dirname(token_path)
+    if not _private_token_dir(token_dir):
+        return
+
+    try:
+        # Write to a private temporary file & swap it in so readers never see a partial token
+        fd, tmp_path = tempfile.mkstemp(dir=token_dir)
+        with os.fdopen(fd, "w") as token_file:
+            json.dump(token, token_file)
+        os.replace(tmp_path, token_path)
+    except OSError:
+        logging.warning("Unable to save the Google access token to %s", token_path)
 
 
 class GoogleAdmin(object):
@@ -52,7 +179,13 @@ class GoogleAdmin(object):
     """
 
     def __init__(
-        self, service_account_json, sub_account, calendar_id, welcome_text, welcome_attachments
+        self,
+        service_account_json,
+        sub_account,
+        calendar_id,
+        welcome_text,
+        welcome_attachments,
+        token_cache_dir=None,
     ):
         """Initialize Google API Service Interface
 
@@ -65,20 +198,57 @@ class GoogleAdmin(object):
             calendar_id (str): The company calendar to add new users to as readers
             welcome_text (str): Customizable welcome email text for each new account
             welcome_attachments (list): Customizable list of files to attach to welcome email
+            token_cache_dir (Optional[str]): Directory to save OAuth access tokens in, so they can
+                be reused until they expire. Created private to the current user - tokens aren't
+                cached if it's owned by another user, or if not passed.
         """
-        credentials = ServiceAccountCredentials._from_parsed_json_keyfile(
-            service_account_json, SCOPES
-        )
-        delegated_creds = credentials.create_delegated(sub_account)
-        http = delegated_creds.authorize(Http())
         self.sub_account = sub_account
         self.calendar_id = calendar_id
-        self.admin_service = build("admin", "directory_v1", http=http)
-        self.gmail_service = build("gmail", "v1", http=http)
-        self.cal_service = build("calendar", "v3", http=http)
-        self.primary_domain = self._get_primary_domain()
+
+        cache_key = (service_account_json["client_email"], sub_account)
+        if cache_key in _SERVICE_CACHE:
+            (
+                self.admin_service,
+                self.gmail_service,
+                self.cal_service,
+                self.primary_domain,
+            ) = _SERVICE_CACHE[cache_key]
+        else:
+            credentials = ServiceAccountCredentials._from_parsed_json_keyfile(
+                service_account_json, SCOPES
+            )
+            delegated_creds = credentials.create_delegated(sub_account)
+            token_path = None
+            if token_cache_dir:
+                token_hash = hashlib.sha256(
+                    " ".join(cache_key + tuple(SCOPES)).encode()
+                ).hexdigest()
+                token_path = os.path.join(
+                    token_cache_dir, "google-token-{}.json".format(token_hash)
+                )
+                _load_access_token(delegated_creds, token_path)
+            # One Http for all services, so their requests reuse the same googleapis.com connection
+            http = delegated_creds.authorize(Http(timeout=HTTP_TIMEOUT))
+            self.admin_service = build("admin", "directory_v1", http=http, static_discovery=True)
+            self.gmail_service = build("gmail", "v1", http=http, static_discovery=True)
+            self.cal_service = build("calendar", "v3", http=http, static_discovery=True)
+            self.primary_domain = self._get_primary_domain()
+            if token_path:
+                # The primary domain request made sure the access token is fresh
+                _save_access_token(delegated_creds, token_path)
+            _SERVICE_CACHE[cache_key] = (
+                self.admin_service,
+                self.gmail_service,
+                self.cal_service,
+                self.primary_domain,
+            )
+        # Appended to usernames & group names to build their email addresses
+        self._email_suffix = "@" + self.primary_domain
+
         self.welcome_text = welcome_text
         self.welcome_attachments = welcome_attachments
+        # Username availability answers keyed by username - (time.monotonic() checked, available)
+        self._username_cache = {}
 
     def create_user(self, given_name, family_name, username, personal_email, job_title, groups):
         """Create a new Google user and add him/her to the list of groups passed.
@@ -91,7 +261,7 @@ class GoogleAdmin(object):
             job_title (str): Job title of new user
             groups (list): List of google group names determined by GZChunker
         """
-        email = "{}@{}".format(username, self.primary_domain)
+        email = username + self._email_suffix
         emails = [
             {"address": email, "primary": True, "type": "work"},
             {"address": personal_email, "type": "other"},
@@ -99,7 +269,7 @@ class GoogleAdmin(object):
         orgs = [{"primary": True, "title": job_title}]
         password = self._generate_password()
 
-        logging.info("Creating new google account - {}".format(email))
+        logging.info("Creating new google account - %s", email)
         response = (
             self.admin_service.users()
             .insert(
@@ -114,20 +284,23 @@ class GoogleAdmin(object):
             )
             .execute()
         )
+        self._username_cache[username] = (time.monotonic(), False)
 
         yield "User created! Going to add them to the following groups now: *{}*".format(
             ", ".join(groups)
         )
+        group_requests = []
         for group in groups:
-            group_key = "{}@{}".format(group, self.primary_domain)
-            logging.info("Adding {} to the '{}' group".format(email, group_key))
-            (
-                self.admin_service.members()
-                .insert(groupKey=group_key, body={"email": email, "role": "MEMBER"})
-                .execute()
+            group_key = group + self._email_suffix
+            logging.info("Adding %s to the '%s' group", email, group_key)
+            group_requests.append(
+                self.admin_service.members().insert(
+                    groupKey=group_key, body={"email": email, "role": "MEMBER"}
+                )
             )
+        self._execute_batch(self.admin_service, group_requests)
 
-        logging.info("Adding {} to the '{}' calendar".format(email, self.calendar_id))
+        logging.info("Adding %s to the '%s' calendar", email, self.calendar_id)
         (
             self.cal_service.acl()
             .insert(
@@ -138,7 +311,7 @@ class GoogleAdmin(object):
         )
 
         yield "Sending them a welcome email to their personal address with login credentials to the new account."
-        logging.info("Emailing {} the credentials of the new google account".format(given_name))
+        logging.info("Emailing %s the credentials of the new google account", given_name)
         message_text = """
 Hello {given_name},
 
@@ -165,6 +338,37 @@ Start using your new account by signing in at https://www.google.com/accounts/Ac
         # Send message as super admin
         self.send_message("me", message)
 
+    def _execute_batch(self, service, requests, batch_size=MAX_BATCH_REQUESTS):
+        """Execute API requests using as few HTTP round trips as possible.
+
+        Requests are sent through the service's batch endpoint, batch_size at a time.
+
+        Args:
+            service (Resource): The API service object the requests were created from.
+            requests (list): List of HttpRequest objects to execute.
+            batch_size (int): The most requests to send in a single batch request.
+
+        Returns:
+            list: The response of each request, in the order the requests were passed.
+
+        Raises:
+            HttpError: If any of the batched requests failed.
+        """
+        responses = []
+
+        def callback(request_id, response, exception):
+            # Raise a failed request's error just like execute() would
+            if exception is not None:
+                raise exception
+            responses.append(response)
+
+        for start in range(0, len(requests), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for request in requests[start : start + batch_size]:
+                batch.add(request)
+            batch.execute()
+        return responses
+
     def _create_message(self, to, subject, message_text, message_attachments):
         """Create a message for an email.
 
@@ -177,7 +381,12 @@ Start using your new account by signing in at https://www.google.com/accounts/Ac
         Returns:
             An object containing a base64url encoded email object.
         """
-        message = MIMEMultipart()
+        try:
+            (to + self.sub_account + subject).encode("ascii")
+            policy = _MESSAGE_POLICY
+        except UnicodeEncodeError:
+            policy = compat32
+        message = MIMEMultipart(policy=policy)
         message["to"] = to
         message["from"] = self.sub_account
         message["subject"] = subject
@@ -186,24 +395,11 @@ Start using your new account by signing in at https://www.google.com/accounts/Ac
         message.attach(msg)
 
         for attachment in message_attachments:
-            content_type, encoding = mimetypes.guess_type(attachment)
-            if content_type is None or encoding is not None:
-                content_type = "application/octet-stream"
-
-            main_type, sub_type = content_type.split("/", 1)
-            if main_type == "text":
-                with open(attachment, "rb") as fp:
-                    msg = MIMEText(fp.read(), _subtype=sub_type)
-            elif main_type == "image":
-                with open(attachment, "rb") as fp:
-                    msg = MIMEImage(fp.read(), _subtype=sub_type)
-            elif main_type == "audio":
-                with open(attachment, "rb") as fp:
-                    msg = MIMEAudio(fp.read(), _subtype=sub_type)
-            else:
-                with open(attachment, "rb") as fp:
-                    msg = MIMEBase(main_type, sub_type)
-                    msg.set_payload(fp.read())
+            # Attach the file's bytes as-is so they're only base64 encoded once
+            main_type, sub_type = _guess_content_type(attachment).split("/", 1)
+            msg = MIMEBase(main_type, sub_type)
+            with open(attachment, "rb") as fp:
+                msg.set_payload(fp.read())
 
             encode_base64(msg)
             filename = os.path.basename(attachment)
@@ -224,9 +420,55 @@ Start using your new account by signing in at https://www.google.com/accounts/Ac
           Sent Message.
         """
         message = self.gmail_service.users().messages().send(userId=user_id, body=message).execute()
-        logging.info("Sent Message Id: {}".format(message["id"]))
+        logging.info("Sent Message Id: %s", message["id"])
         return message
 
+    def send_messages(self, user_id, messages):
+        """Send multiple email messages, batching them into as few requests as possible.
+
+        A failed message doesn't stop the rest from being sent - each message's outcome is
+        returned, so callers know exactly which emails went out & never have to resend them all.
+
+        Args:
+          user_id: User's email address. The special value "me"
+          can be used to indicate the authenticated user.
+          messages: List of messages to be sent.
+
+        Returns:
+          List of (Sent Message, None) or (None, HttpError) tuples, in the order the messages
+          were passed.
+        """
+        outcomes = {}
+
+        def callback(request_id, response, exception):
+            outcomes[request_id] = (response, exception)
+
+        for start in range(0, len(messages), MAX_GMAIL_BATCH_REQUESTS):
+            batch = self.gmail_service.new_batch_http_request(callback=callback)
+            chunk = messages[start : start + MAX_GMAIL_BATCH_REQUESTS]
+            request_ids = [str(index) for index in range(start, start + len(chunk))]
+            for request_id, message in zip(request_ids, chunk):
+                batch.add(
+                    self.gmail_service.users().messages().send(userId=user_id, body=message),
+                    request_id=request_id,
+                )
+            try:
+                batch.execute()
+            except HttpError as e:
+                # The whole batch request failed - none of its callbacks ran
+                for request_id in request_ids:
+                    outcomes.setdefault(request_id, (None, e))
+
+        results = []
+        for index in range(len(messages)):
+            sent_message, error = outcomes[str(index)]
+            if error is None:
+                logging.info("Sent Message Id: %s", sent_message["id"])
+            else:
+                logging.warning("Unable to send message %d: %s", index, error)
+            results.append((sent_message, error))
+        return results
+
     def is_username_available(self, username):
         """Check if a username is available in the primary domain.
 
@@ -236,29 +478,48 @@ Start using your new account by signing in at https://www.google.com/accounts/Ac
         Returns:
             bool: If the name is available, return True, False otherwise
         """
-        email = "{}@{}".format(username, self.primary_domain)
+        cached = self._username_cache.get(username)
+        if cached is not None:
+            checked_at, available = cached
+            if not available or time.monotonic() - checked_at < USERNAME_CACHE_TTL:
+                return available
+
+        email = username + self._email_suffix
         try:
             self.admin_service.users().get(userKey=email).execute()
             # Executed without error, meaning this user already exists
-            return False
+            available = False
         except HttpError:
             # Error was raised since the user isn't found, meaning it's available
-            return True
+            available = True
+        self._username_cache[username] = (time.monotonic(), available)
+        return available
 
     def _generate_password(self):
         """Generate a random password comprised of PASSWORD_LENGTH PASSWORD_CHARACTERS.
 
+        Characters are picked with cryptographically secure random bytes from the secrets module.
+
         Returns:
             str: A randomly generated password.
         """
-        return "".join(random.choice(PASSWORD_CHARACTERS) for _ in range(PASSWORD_LENGTH))
+        password = b""
+        while len(password) < PASSWORD_LENGTH:
+            random_bytes = secrets.token_bytes(PASSWORD_LENGTH * 2)
+            password += random_bytes.translate(_PASSWORD_TABLE, _PASSWORD_REJECTS)
+        return password[:PASSWORD_LENGTH].decode("ascii")
 
     def _get_primary_domain(self):
         """Get the primary domain for this Google Account.
 
         Returns:
             str: The primary domain of the google account.
+
+        Raises:
+            ValueError: If the account has no primary domain.
         """
         domains = (self.admin_service.domains().list(customer="my_customer").execute())["domains"]
-        (primary_domain,) = [d["domainName"] for d in domains if d["isPrimary"]]
+        primary_domain = next((d["domainName"] for d in domains if d["isPrimary"]), None)
+        if primary_domain is None:
+            raise ValueError("No primary domain found for this Google account")
         return primary_domain
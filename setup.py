@@ -12,7 +12,12 @@ with open("README.rst") as readme_file:
 with open("HISTORY.rst") as history_file:
     history = history_file.read()
 
-requirements = ["nltk==3.2.1", "python-dateutil==2.5.2", "google-api-python-client==1.5"]
+requirements = [
+    "nltk==3.2.1",
+    "python-dateutil==2.5.2",
+    "google-api-python-client>=2.0",
+    "oauth2client>=2.2,<5",
+]
 
 test_requirements = [
     # TODO: put package test requirements here
@@ -32,7 +37,7 @@ setup(
     include_package_data=True,
     install_requires=requirements,
     # license="ISCL",
-    zip_safe=False,
+    zip_safe=True,
     keywords="godzillops",
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
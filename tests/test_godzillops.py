@@ -7,20 +7,56 @@ test_godzillops
 
 Tests for `godzillops` module.
 """
+import base64
+import email
 import json
+import logging
 import os
+import re
 import sys
+import tempfile
+import time
 import unittest
 import urllib.parse as urlparse
+import urllib.request
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from email.header import decode_header, make_header
 from functools import partial
 from unittest.mock import Mock, patch, call
 
+import nltk
 from apiclient.errors import HttpError
 from httplib2 import Response
-from godzillops import godzillops
+from oauth2client.service_account import ServiceAccountCredentials
+from godzillops import godzillops, google
 
 TEST_DIR = os.path.dirname(__file__)
 sys.path.append(TEST_DIR)
+import config_test
+
+# Trimmed down giphy search response - gz_gif picks one of the first 24 gifs
+GIPHY_RESPONSE = json.dumps(
+    {"data": [{"images": {"downsized": {"url": "giphy.com"}}}] * 27}
+).encode()
+# Directory API error for a username nobody has taken yet
+USER_NOT_FOUND = HttpError(Response({"status": 404}), b"User does not exist.")
+# Gmail API response for a successfully sent welcome email
+GMAIL_SEND_RESULT = {"id": "123456789"}
+# Directory API domains list - GoogleAdmin picks the primary domain for new accounts
+DOMAINS_LIST = {
+    "domains": [
+        {"isPrimary": False, "domainName": "example.org"},
+        {"isPrimary": True, "domainName": "example.com"},
+    ]
+}
+# Request bodies GZ sends when inviting Bill Tester to Trello, a GitHub dev team & Abacus
+TRELLO_INVITE_BODY = urlparse.urlencode(
+    {"email": "bill@example.com", "fullName": "Bill Tester"}
+).encode()
+GITHUB_MEMBERSHIP_BODY = json.dumps({"role": "member"}).encode()
+ABACUS_INVITE_BODY = json.dumps({"email": "bill@example.com"}).encode()
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 def apiclient_mock_creator(mocks):
@@ -31,6 +67,8 @@ def apiclient_mock_creator(mocks):
 
 
 class MockUrllibResponse(object):
+    __slots__ = ("status", "content")
+
     def __init__(self, status, content=None):
         self.status = status
         if content and not isinstance(content, bytes):
@@ -41,102 +79,163 @@ class MockUrllibResponse(object):
         return self.content
 
 
+def urlreq_mock_creator():
+    urlresp = MockUrllibResponse(status=200)
+    urlreq = Mock(spec=urllib.request)
+    # Named, so urlopen doesn't adopt it and record its __enter__/__exit__ calls as its own
+    urlreq.urlopen.return_value = Mock(
+        name="urlopen",
+        __enter__=Mock(return_value=urlresp),
+        __exit__=Mock(return_value=False),
+    )
+    return urlreq, urlresp
+
+
 class TestChat(unittest.TestCase):
-    def setUp(self):
-        """setUp runs before every test is executed.
+    @classmethod
+    def setUpClass(cls):
+        """setUpClass runs once before any test is executed.
 
-        Make sure that we create and mock all API pieces - i.e. Google API objects & Trello urllib calls.
+        Make sure that we create and mock all API pieces - i.e. Google API objects & Trello urllib calls,
+        then create the Chat instance shared by every test - loading its tagger is expensive.
         """
-        # First, we need to create our per-test mocks
-
-        # == Godzillops ==
-        self.logging_mock = Mock(name="logging")
-        self.gz_urlreq = Mock(name="urlreq")
-        self.gz_urlresp = MockUrllibResponse(status=200)
-        self.gz_urlreq.urlopen.return_value = Mock(
-            name="urlopen",
-            __enter__=Mock(return_value=self.gz_urlresp),
-            __exit__=Mock(return_value=False),
-        )
-        self.gz_patch = patch.multiple(
-            "godzillops.godzillops", logging=self.logging_mock, urlreq=self.gz_urlreq
-        )
-        self.gz_patch.start()
-
-        # == Google Mocks ==
-        self.service_cred_mock = Mock(name="ServiceAccountCredentials")
-        self.admin_service_mock = Mock(name="admin_service")
-        self.admin_service_mock.domains().list(customer="my_customer").execute = Mock(
-            return_value={
-                "domains": [
-                    {"isPrimary": False, "domainName": "example.org"},
-                    {"isPrimary": True, "domainName": "example.com"},
-                ]
-            }
-        )
-        self.gmail_service_mock = Mock(name="gmail_service")
-        self.cal_service_mock = Mock(name="cal_service")
-        self.apiclient_build_mock = apiclient_mock_creator(
-            {
-                "admin": self.admin_service_mock,
-                "gmail": self.gmail_service_mock,
-                "calendar": self.cal_service_mock,
-            }
-        )
-        self.google_patch = patch.multiple(
-            "godzillops.google",
-            ServiceAccountCredentials=self.service_cred_mock,
-            build=self.apiclient_build_mock,
-        )
-        self.google_patch.start()
-
-        # == Trello Mocks ==
-        self.trello_urlreq = Mock(name="urlreq")
-        self.trello_urlresp = MockUrllibResponse(status=200)
-        self.trello_urlreq.urlopen.return_value = Mock(
-            name="urlopen",
-            __enter__=Mock(return_value=self.trello_urlresp),
-            __exit__=Mock(return_value=False),
-        )
-        self.trello_patch = patch("godzillops.trello.urlreq", self.trello_urlreq)
-        self.trello_patch.start()
-
-        # == GitHub Mocks ==
-        self.github_urlreq = Mock(name="urlreq")
-        self.github_urlresp = MockUrllibResponse(status=200)
-        self.github_urlreq.urlopen.return_value = Mock(
-            name="urlopen",
-            __enter__=Mock(return_value=self.github_urlresp),
-            __exit__=Mock(return_value=False),
-        )
-        self.github_patch = patch("godzillops.github.urlreq", self.github_urlreq)
-        self.github_patch.start()
-
-        # == Abacus Mocks ==
-        self.abacus_urlreq = Mock(name="urlreq")
-        self.abacus_urlresp = MockUrllibResponse(status=200)
-        self.abacus_urlreq.urlopen.return_value = Mock(
-            name="urlopen",
-            __enter__=Mock(return_value=self.abacus_urlresp),
-            __exit__=Mock(return_value=False),
+        # All patches are undone at once by tearDownClass, or right away if setUpClass fails
+        with ExitStack() as patches:
+
+            # == Godzillops ==
+            cls.logging_mock = Mock(name="logging", spec=logging)
+            cls.gz_urlreq, cls.gz_urlresp = urlreq_mock_creator()
+            # Keep cached OAuth tokens out of the real godzillops cache directory
+            cls.cache_dir = patches.enter_context(tempfile.TemporaryDirectory())
+            patches.enter_context(
+                patch.multiple(
+                    "godzillops.godzillops",
+                    CACHE_DIR=cls.cache_dir,
+                    logging=cls.logging_mock,
+                    urlreq=cls.gz_urlreq,
+                )
+            )
+
+            # == Google Mocks ==
+            cls.service_cred_mock = Mock(
+                name="ServiceAccountCredentials", spec=ServiceAccountCredentials
+            )
+            cls.delegated_creds_mock = (
+                cls.service_cred_mock._from_parsed_json_keyfile.return_value.create_delegated.return_value
+            )
+            # Service mocks are swapped out before each test, build returns the current ones
+            cls.google_services = {}
+            cls.apiclient_build_mock = apiclient_mock_creator(cls.google_services)
+            patches.enter_context(
+                patch.multiple(
+                    "godzillops.google",
+                    ServiceAccountCredentials=cls.service_cred_mock,
+                    build=cls.apiclient_build_mock,
+                )
+            )
+
+            # == Trello Mocks ==
+            cls.trello_urlreq, cls.trello_urlresp = urlreq_mock_creator()
+            patches.enter_context(patch("godzillops.trello.urlreq", cls.trello_urlreq))
+
+            # == GitHub Mocks ==
+            cls.github_urlreq, cls.github_urlresp = urlreq_mock_creator()
+            patches.enter_context(patch("godzillops.github.urlreq", cls.github_urlreq))
+
+            # == Abacus Mocks ==
+            cls.abacus_urlreq, cls.abacus_urlresp = urlreq_mock_creator()
+            patches.enter_context(patch("godzillops.abacus.urlreq", cls.abacus_urlreq))
+
+            # Mocking & Patching all done, create a patched instance of our Chat class - sans Logging/API pieces
+            cls._create_google_service_mocks()
+            google._SERVICE_CACHE.clear()
+            cls.chat = godzillops.Chat(config_test)
+            cls.patches = patches.pop_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.patches.close()
+
+    @classmethod
+    def _create_google_service_mocks(cls):
+        cls.delegated_creds_mock.access_token = None
+        cls.delegated_creds_mock.token_expiry = None
+        cls.admin_service_mock = Mock(name="admin_service")
+        admin_domains = cls.admin_service_mock.domains.return_value
+        admin_domains.list.return_value.execute.return_value = DOMAINS_LIST
+        cls.users_get_execute = cls.admin_service_mock.users.return_value.get.return_value.execute
+        cls.gmail_service_mock = Mock(name="gmail_service")
+        gmail_messages = cls.gmail_service_mock.users.return_value.messages.return_value
+        cls.messages_send_execute = gmail_messages.send.return_value.execute
+        cls.cal_service_mock = Mock(name="cal_service")
+        cls.google_services.update(
+            admin=cls.admin_service_mock,
+            gmail=cls.gmail_service_mock,
+            calendar=cls.cal_service_mock,
         )
-        self.abacus_patch = patch("godzillops.abacus.urlreq", self.abacus_urlreq)
-        self.abacus_patch.start()
 
-        # Mocking & Patching all done, create a patched instance of our Chat class - sans Logging/API pieces
-        import config_test
+    def setUp(self):
+        """setUp runs before every test is executed.
 
-        self.chat = godzillops.Chat(config_test)
+        Reset the mocks & Chat state a previous test may have changed.
+        """
+        self.logging_mock.reset_mock()
+        self.service_cred_mock.reset_mock()
+        for urlreq, urlresp in (
+            (self.gz_urlreq, self.gz_urlresp),
+            (self.trello_urlreq, self.trello_urlresp),
+            (self.github_urlreq, self.github_urlresp),
+            (self.abacus_urlreq, self.abacus_urlresp),
+        ):
+            urlreq.reset_mock()
+            urlresp.status = 200
+            urlresp.content = None
+
+        # Tests configure return values & side effects deep in the Google service mocks,
+        # which reset_mock won't undo - so give each test fresh ones
+        self._create_google_service_mocks()
+        google._SERVICE_CACHE.clear()
+        google_admin = self.chat.google_admin
+        google_admin.admin_service = self.admin_service_mock
+        google_admin.gmail_service = self.gmail_service_mock
+        google_admin.cal_service = self.cal_service_mock
+        google_admin._username_cache.clear()
+        self.chat.action_state.clear()
+
+    def _create_google_admin(self, **kwargs):
+        return google.GoogleAdmin(
+            config_test.GOOGLE_SERVICE_ACCOUNT_JSON,
+            config_test.GOOGLE_SUPER_ADMIN,
+            config_test.GOOGLE_CALENDAR_ID,
+            config_test.GOOGLE_WELCOME_TEXT,
+            config_test.GOOGLE_WELCOME_ATTACHMENTS,
+            **kwargs,
+        )
 
-    def tearDown(self):
-        self.github_patch.stop()
-        self.trello_patch.stop()
-        self.google_patch.stop()
-        self.gz_patch.stop()
+    def _assert_responses(self, responses, expected_responses):
+        """Run each expected response assertion against the matching response."""
+        responses = list(responses)
+        self.assertEqual(len(responses), len(expected_responses))
+        for assert_response, response in zip(expected_responses, responses):
+            assert_response(response)
 
     def _clear_action_state_assert(self, success, msg):
         return partial(self.assertEqual, {"admin_action_complete": success, "message": msg})
 
+    def _github_membership_calls(self, role, username):
+        """Build the expected GitHub team membership requests for a dev role."""
+        return [
+            call(
+                url=self.chat.github_admin.github_api_url.format(
+                    "teams/{}/memberships/{}".format(team, username)
+                ),
+                data=GITHUB_MEMBERSHIP_BODY,
+                method="PUT",
+                headers=JSON_HEADERS,
+            )
+            for team in self.chat.config.GITHUB_DEV_ROLES[role]
+        ]
+
     def _create_google_account_aux(self, title, groups_to_check, mailto=False):
         (response,) = self.chat.respond("I need to create a new google account.")
         self.assertEqual("What is the employee's full name (Capitalized First & Last)?", response)
@@ -160,16 +259,11 @@ class TestChat(unittest.TestCase):
                 "Aw nuts, that name is taken. Might I suggest a nickname or something like btester",
             ),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
         # Make sure that the username is available
-        self.admin_service_mock.users().get(userKey="bill@example.com").execute = Mock(
-            side_effect=HttpError(Response({"status": 404}), b"User does not exist.")
-        )
+        self.users_get_execute.side_effect = USER_NOT_FOUND
         # Set up proper gmail response
-        self.gmail_service_mock.users().messages().send().execute = Mock(
-            return_value={"id": "123456789"}
-        )
+        self.messages_send_execute.return_value = GMAIL_SEND_RESULT
         self.assertEqual(self.chat.action_state["text"]["step"], "username")
         responses = self.chat.respond("btester")
         expected_responses = [
@@ -183,8 +277,7 @@ class TestChat(unittest.TestCase):
                 "At the bidding of my master (text), I have created a new Google Account for Bill Tester.",
             ),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
     def test_000_chat_init_successful(self):
         """Make sure we initialized the Chat class without exception."""
@@ -192,8 +285,8 @@ class TestChat(unittest.TestCase):
 
     def test_001_respond_exception(self):
         """Test a determine_action exception mid-response."""
-        self.chat.determine_action = Mock(side_effect=ValueError("BOOM!"))
-        (response,) = self.chat.respond("GZ, are you okay?")
+        with patch.object(self.chat, "determine_action", side_effect=ValueError("BOOM!")):
+            (response,) = self.chat.respond("GZ, are you okay?")
         self.logging_mock.exception.assert_called_with("An error occurred responding to the user.")
         self.assertEqual("I... erm... what? Try again.", response)
 
@@ -201,43 +294,37 @@ class TestChat(unittest.TestCase):
         """Test that GZ returns a greeting when greeted."""
         responses = self.chat.respond("Hi Godzilla!")
         expected_responses = [
-            None,
+            lambda response: self.assertIn(response.lower(), self.chat.chunker.greetings),
             partial(self.assertEqual, "Can I help you with anything?"),
             self._clear_action_state_assert(False, "Command completed."),
         ]
-        for index, response in enumerate(responses):
-            if not index:
-                self.assertIn(response.lower(), self.chat.chunker.greetings)
-            else:
-                expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
         # Test a no-action input - GZ returns nothing
         response = self.chat.respond("Maybe?")
         self.assertEqual(response, ())
 
     def test_003_gz_gif(self):
         """Test that GZ returns a random godzilla gif when only his name is mentioned."""
-        with open(os.path.join(TEST_DIR, "giphy.json"), "rb") as giphy_json:
-            self.gz_urlresp.content = giphy_json.read()
+        self.gz_urlresp.content = GIPHY_RESPONSE
         responses = self.chat.respond("Gojira!")
         expected_responses = [
             partial(self.assertEqual, "RAWR!"),
             partial(self.assertIn, "giphy.com"),
             self._clear_action_state_assert(False, "Command completed."),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
         self.gz_urlreq.urlopen.assert_called_with(self.chat.config.GZ_GIF_URL)
 
     def test_004_create_google_account(self):
         """Create google account with a single Chat.respond call."""
         # Make sure that the username is available
-        self.admin_service_mock.users().get(userKey="almondo@example.com").execute = Mock(
-            side_effect=HttpError(Response({"status": 404}), b"User does not exist.")
-        )
+        self.users_get_execute.side_effect = USER_NOT_FOUND
         # Set up proper gmail response
-        self.gmail_service_mock.users().messages().send().execute = Mock(
-            return_value={"id": "123456789"}
-        )
+        self.messages_send_execute.return_value = GMAIL_SEND_RESULT
+        # Give each group membership request its own mock, to check what gets batched
+        members_insert = self.admin_service_mock.members.return_value.insert
+        member_requests = [Mock(name="dev_member_request"), Mock(name="backend_member_request")]
+        members_insert.side_effect = member_requests
         responses = self.chat.respond(
             "I need to create a google account for Almondo Finklebottom."
             " His email is almondo@gmail.com, and his title will be"
@@ -254,9 +341,19 @@ class TestChat(unittest.TestCase):
                 "At the bidding of my master (text), I have created a new Google Account for Almondo Finklebottom.",
             ),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
-
+        self._assert_responses(responses, expected_responses)
+
+        # Both group memberships are added in a single batch request
+        member_body = {"email": "almondo@example.com", "role": "MEMBER"}
+        members_insert.assert_has_calls(
+            [
+                call(groupKey="dev@example.com", body=member_body),
+                call(groupKey="backend@example.com", body=member_body),
+            ]
+        )
+        batch = self.admin_service_mock.new_batch_http_request.return_value
+        self.assertEqual(batch.add.call_args_list, [call(request) for request in member_requests])
+        batch.execute.assert_called_once_with()
         self.cal_service_mock.acl().insert.assert_called_with(
             calendarId=self.chat.config.GOOGLE_CALENDAR_ID,
             body={"role": "reader", "scope": {"type": "user", "value": "almondo@example.com"}},
@@ -291,12 +388,12 @@ class TestChat(unittest.TestCase):
             ),
         ]
 
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
         members_url = self.chat.trello_admin.trello_api_url.format("organizations/yourorg/members")
-        data = urlparse.urlencode({"email": "bill@example.com", "fullName": "Bill Tester"}).encode()
-        self.trello_urlreq.Request.assert_called_with(url=members_url, data=data, method="PUT")
+        self.trello_urlreq.Request.assert_called_with(
+            url=members_url, data=TRELLO_INVITE_BODY, method="PUT"
+        )
         self.trello_urlreq.urlopen.assert_called_with(self.trello_urlreq.Request())
 
     def test_008_invite_to_trello(self):
@@ -307,8 +404,7 @@ class TestChat(unittest.TestCase):
             partial(self.assertIn, "Huh, that didn't work"),
             self._clear_action_state_assert(False, "I have failed you."),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
     def test_009_slack_and_cancel(self):
         """Test Slack specific behavior by adding a user to trello, then canceling."""
@@ -330,8 +426,7 @@ class TestChat(unittest.TestCase):
             partial(self.assertIn, "Previous action canceled."),
             self._clear_action_state_assert(False, "Command completed."),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
     def test_0010_invite_to_github(self):
         """Test inviting a new user to our GitHub organization/team."""
@@ -345,24 +440,9 @@ class TestChat(unittest.TestCase):
                 "At the bidding of my master (text), I have invited billyt3st3r to join our GitHub organization.",
             ),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
-
-        urlreq_calls = []
-        data = json.dumps({"role": "member"}).encode()
-        for team in self.chat.config.GITHUB_DEV_ROLES["backend"]:
-            members_url = self.chat.github_admin.github_api_url.format(
-                "teams/{}/memberships/billyt3st3r".format(team)
-            )
-            urlreq_calls.append(
-                call(
-                    url=members_url,
-                    data=data,
-                    method="PUT",
-                    headers={"Content-Type": "application/json"},
-                )
-            )
+        self._assert_responses(responses, expected_responses)
 
+        urlreq_calls = self._github_membership_calls("backend", "billyt3st3r")
         self.github_urlreq.Request.assert_has_calls(urlreq_calls)
         self.github_urlreq.urlopen.assert_has_calls(
             (call(self.github_urlreq.Request()), call(self.github_urlreq.Request()))
@@ -378,24 +458,10 @@ class TestChat(unittest.TestCase):
         self.assertIn("What will be the user's dev role on our team? Choose from:", response)
         responses = self.chat.respond("frontend")
 
-        expected_responses, urlreq_calls = [], []
+        expected_responses = []
         expected_responses.append(
             partial(self.assertIn, "invited `{}` to join *yourorg* in GitHub".format(username))
         )
-        urlreq_calls = []
-        data = json.dumps({"role": "member"}).encode()
-        for team in self.chat.config.GITHUB_DEV_ROLES["frontend"]:
-            members_url = self.chat.github_admin.github_api_url.format(
-                "teams/{}/memberships/billyt3st3r".format(team)
-            )
-            urlreq_calls.append(
-                call(
-                    url=members_url,
-                    data=data,
-                    method="PUT",
-                    headers={"Content-Type": "application/json"},
-                )
-            )
         expected_responses.append(
             self._clear_action_state_assert(
                 True,
@@ -403,9 +469,9 @@ class TestChat(unittest.TestCase):
             )
         )
 
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
+        urlreq_calls = self._github_membership_calls("frontend", username)
         self.github_urlreq.Request.assert_has_calls(urlreq_calls)
         self.github_urlreq.urlopen.assert_called_with(self.github_urlreq.Request())
 
@@ -417,8 +483,7 @@ class TestChat(unittest.TestCase):
             partial(self.assertIn, "Huh, I couldn't add `billyt3st3r` to *yourorg* in GitHub"),
             self._clear_action_state_assert(False, "I have failed you."),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
     def test_013_context_exception(self):
         """Test responding to a borked context object"""
@@ -440,15 +505,13 @@ class TestChat(unittest.TestCase):
             ),
         ]
 
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
-        data = json.dumps({"email": "bill@example.com"}).encode()
         self.abacus_urlreq.Request.assert_called_with(
             url=self.chat.config.ABACUS_ZAPIER_WEBHOOK,
-            data=data,
+            data=ABACUS_INVITE_BODY,
             method="POST",
-            headers={"Content-Type": "application/json"},
+            headers=JSON_HEADERS,
         )
         self.abacus_urlreq.urlopen.assert_called_with(self.abacus_urlreq.Request())
 
@@ -460,8 +523,7 @@ class TestChat(unittest.TestCase):
             partial(self.assertIn, "Huh, that didn't work"),
             self._clear_action_state_assert(False, "I have failed you."),
         ]
-        for index, response in enumerate(responses):
-            expected_responses[index](response)
+        self._assert_responses(responses, expected_responses)
 
     def test_016_create_google_account(self):
         """Create Developer google account with a multiple Chat.respond calls.
@@ -475,6 +537,218 @@ class TestChat(unittest.TestCase):
         """
         self._create_google_account_aux("General Manager", ["founders"], mailto=True)
 
+    def test_018_tokenize_simple_input(self):
+        """Make sure plain word input tokenizes the same as it would with the NLTK tokenizers."""
+        for _input in ("Bill Tester", "frontend", " Nevermind ", "Hi Godzilla!", "btester2"):
+            tokens = self.chat._tokenize(_input, {})
+            self.assertEqual(self.chat.tokenizer.tokenize(_input), tokens)
+            tokens = self.chat._tokenize(_input, {"regexp_tokenize": True})
+            self.assertEqual(nltk.regexp_tokenize(_input, r"[\w]+"), tokens)
+
+    def test_019_google_services_cached(self):
+        """Make sure another Chat instance reuses the cached Google services & primary domain."""
+        google_admin = self._create_google_admin()
+        cached_google_admin = self._create_google_admin()
+        self.assertIs(cached_google_admin.admin_service, google_admin.admin_service)
+        self.assertEqual(cached_google_admin.primary_domain, "example.com")
+        self.service_cred_mock._from_parsed_json_keyfile.assert_called_once_with(
+            config_test.GOOGLE_SERVICE_ACCOUNT_JSON, google.SCOPES
+        )
+        admin_domains = self.admin_service_mock.domains.return_value
+        admin_domains.list.assert_called_once_with(customer="my_customer")
+        admin_domains.list.return_value.execute.assert_called_once_with()
+
+    def test_020_generate_password(self):
+        """Make sure generated passwords are the right length and use only allowed characters."""
+        password = self.chat.google_admin._generate_password()
+        self.assertEqual(len(password), google.PASSWORD_LENGTH)
+        self.assertTrue(set(password) <= set(google.PASSWORD_CHARACTERS))
+        self.assertNotEqual(password, self.chat.google_admin._generate_password())
+
+    def test_021_create_message_attachments(self):
+        """Make sure welcome email attachments are base64 encoded exactly once."""
+        attachments = {"welcome.txt": b"Welcome aboard!\n", "logo.png": b"\x89PNG\r\n\x1a\n"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for filename, content in attachments.items():
+                paths.append(os.path.join(tmp_dir, filename))
+                with open(paths[-1], "wb") as fp:
+                    fp.write(content)
+            message = self.chat.google_admin._create_message(
+                "bill@yahoo.com", "Welcome", "Hello Bill", paths
+            )
+
+        parsed = email.message_from_bytes(base64.urlsafe_b64decode(message["raw"]))
+        body, *parts = parsed.get_payload()
+        self.assertEqual(body.get_payload(), "Hello Bill")
+        for part in parts:
+            self.assertEqual(part.get_all("Content-Transfer-Encoding"), ["base64"])
+            self.assertEqual(part.get_payload(decode=True), attachments[part.get_filename()])
+
+    def test_022_username_availability_cached(self):
+        """Make sure repeat username checks don't hit the Directory API again."""
+        google_admin = self.chat.google_admin
+        self.assertFalse(google_admin.is_username_available("bill"))
+        self.assertFalse(google_admin.is_username_available("bill"))
+        self.assertEqual(self.users_get_execute.call_count, 1)
+
+        self.users_get_execute.side_effect = USER_NOT_FOUND
+        self.assertTrue(google_admin.is_username_available("btester"))
+        self.assertTrue(google_admin.is_username_available("btester"))
+        self.assertEqual(self.users_get_execute.call_count, 2)
+
+        # Stale "available" answers are checked again
+        with patch("godzillops.google.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertTrue(google_admin.is_username_available("btester"))
+        self.assertEqual(self.users_get_execute.call_count, 3)
+
+    def test_023_access_token_cached(self):
+        """Make sure OAuth access tokens are saved to & reused from the token cache directory."""
+        token_expiry = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        token_expiry += timedelta(hours=1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.delegated_creds_mock.access_token = "ya29.token"
+            self.delegated_creds_mock.token_expiry = token_expiry
+            self._create_google_admin(token_cache_dir=tmp_dir)
+            self.assertEqual(len(os.listdir(tmp_dir)), 1)
+
+            google._SERVICE_CACHE.clear()
+            self.delegated_creds_mock.access_token = None
+            self.delegated_creds_mock.token_expiry = None
+            self._create_google_admin(token_cache_dir=tmp_dir)
+            self.assertEqual(self.delegated_creds_mock.access_token, "ya29.token")
+            self.assertEqual(self.delegated_creds_mock.token_expiry, token_expiry)
+
+            # Unreadable token files are ignored rather than stopping GoogleAdmin from being built
+            (token_file,) = os.listdir(tmp_dir)
+            bad_tokens = (
+                "[]",
+                '"x"',
+                '{"access_token": "ya29.token", "token_expiry": 5}',
+                '{"access_token": "ya29.token", "token_expiry": "soon"}',
+                '{"token_expiry": "2099-01-01T00:00:00Z"}',
+            )
+            for bad_token in bad_tokens:
+                with open(os.path.join(tmp_dir, token_file), "w") as f:
+                    f.write(bad_token)
+                google._SERVICE_CACHE.clear()
+                self.delegated_creds_mock.access_token = None
+                self._create_google_admin(token_cache_dir=tmp_dir)
+                self.assertIsNone(self.delegated_creds_mock.access_token)
+
+    def test_024_send_messages(self):
+        """Make sure multiple emails are sent in a single Gmail batch request."""
+        batch = self.gmail_service_mock.new_batch_http_request.return_value
+
+        def batch_execute():
+            _, kwargs = self.gmail_service_mock.new_batch_http_request.call_args
+            for _, add_kwargs in batch.add.call_args_list:
+                request_id = add_kwargs["request_id"]
+                kwargs["callback"](request_id, {"id": request_id}, None)
+
+        batch.execute.side_effect = batch_execute
+        sent_messages = self.chat.google_admin.send_messages("me", [{"raw": "a"}, {"raw": "b"}])
+        self.assertEqual(sent_messages, [({"id": "0"}, None), ({"id": "1"}, None)])
+        self.assertEqual(batch.add.call_count, 2)
+        batch.execute.assert_called_once_with()
+
+    def test_025_tagger_shared(self):
+        """Make sure Chat instances share the tagger instead of loading it again."""
+        self.assertIs(godzillops.Chat(config_test).tagger, self.chat.tagger)
+
+    def test_026_token_cache_dir_private(self):
+        """Make sure access tokens are only cached in a directory nobody else can change."""
+        token_expiry = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        token_expiry += timedelta(hours=1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            token_cache_dir = os.path.join(tmp_dir, "godzillops")
+            os.mkdir(token_cache_dir, 0o755)
+            self.delegated_creds_mock.access_token = "ya29.token"
+            self.delegated_creds_mock.token_expiry = token_expiry
+
+            # Another user created the directory - don't save tokens for them to read or swap out
+            with patch("godzillops.google.os.getuid", return_value=os.getuid() + 1):
+                with self.assertLogs(level="WARNING"):
+                    self._create_google_admin(token_cache_dir=token_cache_dir)
+            self.assertEqual(os.listdir(token_cache_dir), [])
+
+            # Our own directory is locked down before a token is saved in it
+            google._SERVICE_CACHE.clear()
+            self._create_google_admin(token_cache_dir=token_cache_dir)
+            self.assertEqual(os.stat(token_cache_dir).st_mode & 0o777, 0o700)
+            self.assertEqual(len(os.listdir(token_cache_dir)), 1)
+
+            # ...and saved tokens aren't loaded from it once it belongs to someone else
+            google._SERVICE_CACHE.clear()
+            self.delegated_creds_mock.access_token = None
+            self.delegated_creds_mock.token_expiry = None
+            with patch("godzillops.google.os.getuid", return_value=os.getuid() + 1):
+                self._create_google_admin(token_cache_dir=token_cache_dir)
+            self.assertIsNone(self.delegated_creds_mock.access_token)
+
+
+    def test_027_send_messages_failures(self):
+        """Make sure failed emails are reported per message & don't stop the rest from sending."""
+        batch = self.gmail_service_mock.new_batch_http_request.return_value
+        send_error = HttpError(Response({"status": 400}), b"Invalid To header")
+        batch_error = HttpError(Response({"status": 503}), b"Backend Error")
+
+        def batch_execute():
+            _, kwargs = self.gmail_service_mock.new_batch_http_request.call_args
+            _, add_kwargs = batch.add.call_args
+            if add_kwargs["request_id"] == "4":
+                raise batch_error
+            for _, add_kwargs in batch.add.call_args_list[-2:]:
+                request_id = add_kwargs["request_id"]
+                if request_id == "1":
+                    kwargs["callback"](request_id, None, send_error)
+                else:
+                    kwargs["callback"](request_id, {"id": request_id}, None)
+
+        batch.execute.side_effect = batch_execute
+        messages = [{"raw": raw} for raw in "abcde"]
+        with patch("godzillops.google.MAX_GMAIL_BATCH_REQUESTS", 2):
+            sent_messages = self.chat.google_admin.send_messages("me", messages)
+        self.assertEqual(
+            sent_messages,
+            [
+                ({"id": "0"}, None),
+                (None, send_error),
+                ({"id": "2"}, None),
+                ({"id": "3"}, None),
+                (None, batch_error),
+            ],
+        )
+        self.assertEqual(batch.execute.call_count, 3)
+
+
+    def test_028_create_message_headers(self):
+        """Make sure long ASCII headers aren't folded, but non-ASCII ones are still split up."""
+        google_admin = self.chat.google_admin
+        subject = "Welcome to example.com - " + "your new account is ready for use today! " * 3
+        message = google_admin._create_message("bill@yahoo.com", subject, "Hello Bill", [])
+        raw = base64.urlsafe_b64decode(message["raw"]).decode()
+        self.assertIn("\nsubject: {}\n".format(subject), raw)
+
+        subject = "Welcome to exämple.com, Zoë Ångström-Øverli – your new account is ready today"
+        message = google_admin._create_message("zoë@yahoo.com", subject, "Hello Zoë", [])
+        raw = base64.urlsafe_b64decode(message["raw"]).decode()
+        encoded_words = re.findall(r"=\?utf-8\?[qb]\?[^?]*\?=", raw)
+        self.assertGreater(len(encoded_words), 2)
+        self.assertLessEqual(max(map(len, encoded_words)), 78)
+        parsed = email.message_from_string(raw)
+        self.assertEqual(str(make_header(decode_header(parsed["subject"]))), subject)
+
+
+    def test_029_no_primary_domain(self):
+        """Make sure a Google account without a primary domain fails clearly."""
+        admin_domains = self.admin_service_mock.domains.return_value
+        admin_domains.list.return_value.execute.return_value = {
+            "domains": [{"isPrimary": False, "domainName": "example.org"}]
+        }
+        with self.assertRaisesRegex(ValueError, "No primary domain"):
+            self._create_google_admin()
+
 
 if __name__ == "__main__":
     sys.exit(unittest.main())